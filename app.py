@@ -1,12 +1,10 @@
 import streamlit as st
-import pandas as pd
-import numpy as np
-import json
-import os
-import re
-from io import BytesIO
+import time
 from datetime import date
 
+# pandas/numpy ve hesaplama motoru (reco_engine) sadece dosya yüklenince veya sonuç varken import edilir.
+# Streamlit her rerun'da bu dosyayı baştan çalıştırır; boş sayfada ağır import ve HTML işi yapılmaz.
+
 # ==========================================
 # 1. AYARLAR & CSS (GÖRSEL DÜZELTMELER)
 # ==========================================
@@ -26,7 +24,12 @@ st.markdown("""
         margin-bottom: 20px !important;
         display: block;
     }
+</style>
+""", unsafe_allow_html=True)
 
+# Tablo / yorum stilleri sadece sonuç ekranında basılır
+RESULT_CSS = """
+<style>
     /* TABLO STİLİ (SABİT GENİŞLİK & HİZALAMA) */
     .mini-table {
         width: 100%; 
@@ -93,231 +96,17 @@ st.markdown("""
     .list-item { margin-bottom: 8px; margin-left: 20px; font-size: 0.95rem; }
     .sub-list { margin-left: 40px; font-size: 0.9rem; color: #64748b; list-style-type: circle; margin-bottom: 4px; }
 </style>
-""", unsafe_allow_html=True)
-
-# ==========================================
-# 2. TEMPLATE MANAGER
-# ==========================================
-TEMPLATE_FILE = "recomatch_memory.json"
-
-class TemplateManager:
-    @staticmethod
-    def load():
-        if os.path.exists(TEMPLATE_FILE):
-            try:
-                with open(TEMPLATE_FILE, "r", encoding="utf-8") as f: return json.load(f)
-            except: return {}
-        return {}
-
-    @staticmethod
-    def update_template(filename, mapping):
-        templates = TemplateManager.load()
-        key = filename.split('_')[0].lower()
-        if len(key) < 3: key = filename.lower()
-        templates[key] = mapping
-        with open(TEMPLATE_FILE, "w", encoding="utf-8") as f:
-            json.dump(templates, f, ensure_ascii=False, indent=2)
-
-    @staticmethod
-    def find_best_match(filename):
-        templates = TemplateManager.load()
-        for key, val in templates.items():
-            if key in filename.lower(): return val
-        return {}
-
-# ==========================================
-# 3. YARDIMCI FONKSİYONLAR
-# ==========================================
-def normalize_text(s):
-    if pd.isna(s): return ""
-    s = str(s).strip().upper()
-    s = s.replace(" ", "").replace("O", "0")
-    return s
-
-def normalize_currency(val):
-    if pd.isna(val): return "TL"
-    s = str(val).strip().upper().replace(" ", "").replace(".", "")
-    if s in ["TRY", "TRL", "TURKLIRASI", "TÜRKLIRASI", "TL", "YTL"]: return "TL"
-    if s in ["USD", "ABDDOLARI", "USDOLLAR", "DOLAR", "$"]: return "USD"
-    if s in ["EUR", "EURO", "AVRO", "€"]: return "EUR"
-    if s in ["GBP", "STERLIN", "£"]: return "GBP"
-    if s in ["CHF", "ISVICREFRANGI"]: return "CHF"
-    return s
-
-def get_invoice_key(raw_val):
-    val_str = str(raw_val)
-    if val_str.endswith('.0'): val_str = val_str[:-2]
-    clean = re.sub(r'[^A-Z0-9]', '', normalize_text(val_str))
-    return clean
-
-def parse_amount(val):
-    if pd.isna(val) or val == "": return 0.0
-    if isinstance(val, (int, float)): return float(val)
-    s = str(val).strip()
-    is_neg = s.startswith("-") or ("(" in s and ")" in s)
-    s = re.sub(r"[^\d.,]", "", s)
-    if not s: return 0.0
-    try:
-        if "," in s and "." in s:
-            if s.rfind(",") > s.rfind("."): s = s.replace(".", "").replace(",", ".")
-            else: s = s.replace(",", "")
-        elif "," in s: s = s.replace(",", ".")
-        f = float(s)
-        return -f if is_neg else f
-    except: return 0.0
-
-def smart_date_parser(val):
-    if pd.isna(val) or val == "": return pd.NaT
-    if isinstance(val, pd.Timestamp): return val
-    s = str(val).strip()
-    if s.isdigit() or (s.replace('.', '', 1).isdigit() and float(s) > 30000):
-         try: return pd.to_datetime(float(s), unit='D', origin='1899-12-30')
-         except: pass
-    formats = ['%d.%m.%Y', '%Y-%m-%d', '%d-%m-%Y', '%Y.%m.%d', '%d/%m/%Y', '%m/%d/%Y']
-    for fmt in formats:
-        try: return pd.to_datetime(s, format=fmt)
-        except: continue
-    try: return pd.to_datetime(s, dayfirst=True)
-    except: return pd.NaT
-
-def read_and_merge(uploaded_files):
-    if not uploaded_files: return pd.DataFrame()
-    df_list = []
-    for f in uploaded_files:
-        try:
-            if f.name.lower().endswith(".csv"):
-                try: temp_df = pd.read_csv(f, dtype=str, sep=None, engine='python')
-                except: f.seek(0); temp_df = pd.read_csv(f, dtype=str, sep=';')
-            else:
-                temp_df = pd.read_excel(f, header=0, dtype=str)
-            
-            if temp_df.empty: continue
-            temp_df.columns = temp_df.columns.astype(str).str.strip()
-            temp_df["Satır_No"] = temp_df.index + 2 
-            temp_df["Orj_Row_Idx"] = temp_df.index
-            
-            for col in temp_df.columns:
-                if col not in ["Satır_No", "Orj_Row_Idx"]:
-                    temp_df[col] = temp_df[col].astype(str).str.strip().replace({'nan': '', 'None': ''})
-            temp_df["Kaynak_Dosya"] = f.name
-            df_list.append(temp_df)
-        except Exception as e:
-            st.error(f"Dosya hatası ({f.name}): {e}")
-    if not df_list: return pd.DataFrame()
-    return pd.concat(df_list, ignore_index=True)
+"""
 
 # ==========================================
-# 4. HESAPLAMA MANTIĞI
-# ==========================================
-def calculate_smart_balance(row, role, 
-                            mode_tl, c_tl_debt, c_tl_credit, c_tl_single, is_tl_signed,
-                            mode_fx, c_fx_debt, c_fx_credit, c_fx_single, is_fx_signed,
-                            doc_cat):
-    
-    calc_sign = 1
-    if role == "Biz Alıcı":
-        if doc_cat in ["FATURA", "IADE_ODEME"]: calc_sign = 1 
-        else: calc_sign = -1 
-    else: # Biz Satıcı
-        if doc_cat in ["FATURA", "IADE_ODEME"]: calc_sign = -1 
-        else: calc_sign = 1 
-
-    # --- TL ---
-    tl_debt_val = 0.0
-    tl_credit_val = 0.0
-    tl_net = 0.0
-    
-    if mode_tl == "separate":
-        tl_debt_val = parse_amount(row.get(c_tl_debt, 0))
-        tl_credit_val = parse_amount(row.get(c_tl_credit, 0))
-        tl_net = tl_credit_val - tl_debt_val
-    else:
-        raw_tl = parse_amount(row.get(c_tl_single, 0))
-        if is_tl_signed: tl_net = raw_tl
-        else: tl_net = raw_tl * calc_sign
-
-    # --- FX ---
-    fx_net = 0.0
-    if mode_fx == "separate":
-        f_d = parse_amount(row.get(c_fx_debt, 0))
-        f_c = parse_amount(row.get(c_fx_credit, 0))
-        fx_net = f_c - f_d
-    elif mode_fx == "single":
-        raw_fx = parse_amount(row.get(c_fx_single, 0))
-        if raw_fx != 0:
-            if is_fx_signed:
-                fx_net = raw_fx
-            else:
-                if mode_tl == "separate":
-                    if tl_debt_val > 0: fx_net = -abs(raw_fx)
-                    elif tl_credit_val > 0: fx_net = abs(raw_fx)
-                    else: fx_net = raw_fx * calc_sign
-                elif mode_tl == "single" and is_tl_signed:
-                    if tl_net < 0: fx_net = -abs(raw_fx)
-                    elif tl_net > 0: fx_net = abs(raw_fx)
-                    else: fx_net = raw_fx * calc_sign
-                else:
-                    fx_net = raw_fx * calc_sign
-
-    return tl_net, fx_net
-
-def get_doc_category(val, cfg):
-    val = normalize_text(val)
-    if val in [normalize_text(x) for x in cfg.get("FATURA", [])]: return "FATURA"
-    elif val in [normalize_text(x) for x in cfg.get("ODEME", [])]: return "ODEME"
-    elif val in [normalize_text(x) for x in cfg.get("IADE_FATURA", [])]: return "IADE_FATURA"
-    elif val in [normalize_text(x) for x in cfg.get("IADE_ODEME", [])]: return "IADE_ODEME"
-    if val in [normalize_text(x) for x in cfg.get("ACILIS", [])]: return "ACILIS"
-    return "DIGER"
-
-def prepare_data(df, mapping, role):
-    if df.empty: return df
-    df = df.copy()
-    c_date = mapping.get("date")
-    if c_date and c_date in df.columns:
-        df["std_date"] = df[c_date].apply(smart_date_parser)
-    else: df["std_date"] = pd.NaT
-
-    c_type = mapping.get("doc_type")
-    type_cfg = mapping.get("type_vals", {})
-    if c_type and c_type in df.columns:
-        df["Doc_Category"] = df[c_type].apply(lambda x: get_doc_category(x, type_cfg))
-    else: df["Doc_Category"] = "DIGER"
-
-    def wrapper(r):
-        return calculate_smart_balance(
-            r, role,
-            mapping.get("amount_mode", "single"), 
-            mapping.get("col_debt"), mapping.get("col_credit"), mapping.get("col_amount"), mapping.get("is_tl_signed"),
-            mapping.get("fx_amount_mode", "none"),
-            mapping.get("col_fx_debt"), mapping.get("col_fx_credit"), mapping.get("col_fx_amount"), mapping.get("is_fx_signed"),
-            r["Doc_Category"]
-        )
-    
-    res = df.apply(wrapper, axis=1, result_type='expand')
-    df["Signed_TL"] = res[0]
-    df["Signed_FX"] = res[1]
-
-    c_curr = mapping.get("curr")
-    if c_curr and c_curr in df.columns:
-        df["PB_Norm"] = df[c_curr].apply(normalize_currency)
-        df["PB_Norm"] = df["PB_Norm"].replace("", "TL").fillna("TL")
-    else: df["PB_Norm"] = "TL"
-
-    c_inv = mapping.get("inv_no")
-    if c_inv and c_inv in df.columns:
-        df["key_invoice_norm"] = df[c_inv].apply(get_invoice_key)
-    else: df["key_invoice_norm"] = ""
-    return df
-
-# ==========================================
-# 5. UI & MAPPING
+# 2. UI & MAPPING
 # ==========================================
 def safe_idx(cols, val):
     if val in cols: return cols.index(val)
     return 0
 
 def render_mapping_ui(title, df, default_map, key_prefix):
+    import pandas as pd
     st.markdown(f"#### {title} Ayarları")
     cols = ["Seçiniz..."] + list(df.columns)
     
@@ -388,79 +177,40 @@ def render_mapping_ui(title, df, default_map, key_prefix):
     }
 
 # ==========================================
-# 6. GÖRÜNTÜ FORMATLAYICI
+# 3. MAIN FLOW
 # ==========================================
-def format_clean_view(df, map_our, map_their, type="FATURA"):
-    if df.empty: return df
-    
-    if "std_date_Biz" in df.columns:
-        df["std_date_Biz"] = pd.to_datetime(df["std_date_Biz"], errors='coerce').dt.strftime('%d.%m.%Y')
-    if "std_date_Onlar" in df.columns:
-        df["std_date_Onlar"] = pd.to_datetime(df["std_date_Onlar"], errors='coerce').dt.strftime('%d.%m.%Y')
-
-    cols_our, rename_our = [], {}
-    if "Kaynak_Dosya_Biz" in df.columns: cols_our.append("Kaynak_Dosya_Biz"); rename_our["Kaynak_Dosya_Biz"] = "Kaynak (Biz)"
-    
-    our_inv = map_our.get("inv_no")
-    if our_inv and (our_inv + "_Biz") in df.columns:
-        cols_our.append(our_inv + "_Biz")
-        rename_our[our_inv + "_Biz"] = "Fatura No (Biz)" if type == "FATURA" else "İlgili Fatura (Biz)"
-
-    our_pay = map_our.get("pay_no")
-    if type != "FATURA" and our_pay and (our_pay + "_Biz") in df.columns:
-        cols_our.append(our_pay + "_Biz")
-        rename_our[our_pay + "_Biz"] = "Ödeme/Açık. (Biz)"
-
-    cols_our.extend(["std_date_Biz", "Signed_TL_Biz", "Signed_FX_Biz"])
-    rename_our.update({"std_date_Biz": "Tarih (Biz)", "Signed_TL_Biz": "Tutar TL (Biz)", "Signed_FX_Biz": "Tutar FX (Biz)"})
-    
-    if map_our.get("curr") and (map_our.get("curr")+"_Biz" in df.columns):
-        cols_our.append(map_our.get("curr")+"_Biz"); rename_our[map_our.get("curr")+"_Biz"] = "PB (Biz)"
-        
-    for ec in map_our.get("extra_cols", []):
-        if (ec+"_Biz") in df.columns:
-            cols_our.append(ec+"_Biz"); rename_our[ec+"_Biz"] = f"{ec} (Biz)"
-
-    cols_their, rename_their = [], {}
-    if "Kaynak_Dosya_Onlar" in df.columns: cols_their.append("Kaynak_Dosya_Onlar"); rename_their["Kaynak_Dosya_Onlar"] = "Kaynak (Onlar)"
-
-    their_inv = map_their.get("inv_no")
-    if their_inv and (their_inv + "_Onlar") in df.columns:
-        cols_their.append(their_inv + "_Onlar")
-        rename_their[their_inv + "_Onlar"] = "Fatura No (Onlar)" if type == "FATURA" else "İlgili Fatura (Onlar)"
-
-    their_pay = map_their.get("pay_no")
-    if type != "FATURA" and their_pay and (their_pay + "_Onlar") in df.columns:
-        cols_their.append(their_pay + "_Onlar")
-        rename_their[their_pay + "_Onlar"] = "Ödeme/Açık. (Onlar)"
-
-    cols_their.extend(["std_date_Onlar", "Signed_TL_Onlar", "Signed_FX_Onlar"])
-    rename_their.update({"std_date_Onlar": "Tarih (Onlar)", "Signed_TL_Onlar": "Tutar TL (Onlar)", "Signed_FX_Onlar": "Tutar FX (Onlar)"})
-
-    if map_their.get("curr") and (map_their.get("curr")+"_Onlar" in df.columns):
-        cols_their.append(map_their.get("curr")+"_Onlar"); rename_their[map_their.get("curr")+"_Onlar"] = "PB (Onlar)"
-
-    for ec in map_their.get("extra_cols", []):
-        if (ec+"_Onlar") in df.columns:
-            cols_their.append(ec+"_Onlar"); rename_their[ec+"_Onlar"] = f"{ec} (Onlar)"
-
-    final_cols = cols_our + cols_their + ["Fark_TL", "Fark_FX"]
-    final_rename = {**rename_our, **rename_their, "Fark_TL": "Fark (TL)", "Fark_FX": "Fark (FX)"}
-    
-    existing = [c for c in final_cols if c in df.columns]
-    out_df = df[existing].rename(columns=final_rename)
-    if out_df.empty: return pd.DataFrame()
-    return out_df
-
-# ==========================================
-# 7. MAIN FLOW
-# ==========================================
-def force_suffix(df, suffix, key_col):
-    new_cols = {}
-    for c in df.columns:
-        if c == key_col: continue
-        new_cols[c] = f"{c}{suffix}"
-    return df.rename(columns=new_cols)
+@st.cache_data(show_spinner=False, max_entries=8)
+def load_files(files):
+    # files: ((ad, bytes), ...) -> aynı dosyalar için rerun'larda tekrar parse edilmez
+    import reco_engine as eng
+    return eng.read_files(files)
+
+def submit_analysis(*args):
+    import reco_engine as eng
+    old = st.session_state.get("job")
+    if old is not None and not old.done: old.cancel()
+    job = eng.AnalysisJob()
+    job.future = eng.get_worker_pool().submit(eng.run_analysis, *args, progress=job.report, check=job.check)
+    st.session_state["job"] = job
+    return job
+
+@st.fragment(run_every=0.5)
+def job_status_panel():
+    # Sadece bu panel yarım saniyede bir yenilenir; sayfanın geri kalanı (dosyalar, eşleştirme UI, sonuçlar) yeniden çizilmez
+    import reco_engine as eng
+    job = st.session_state.get("job")
+    if job is None: return
+    if job.done:
+        st.rerun()  # tüm sayfa: sonuç aşağıdaki JOB DURUMU bloğunda alınır
+    n_done = len(job.stages)
+    cur = eng.ANALYSIS_STAGES[n_done] if n_done < len(eng.ANALYSIS_STAGES) else "Tamamlanıyor"
+    st.progress(n_done / len(eng.ANALYSIS_STAGES), text=f"Hesaplanıyor: {cur} ({time.time() - job.started:.0f} sn)")
+    if job.stages:
+        st.caption(" · ".join([f"{s}: {n:,} satır" for s, n in job.stages]))
+    if job.cancel_event.is_set():
+        st.caption("İptal ediliyor...")
+    elif st.button("Analizi İptal Et"):
+        job.cancel()
 
 with st.sidebar:
     # --- LOGO (BÜYÜK) ---
@@ -478,18 +228,19 @@ with st.sidebar:
     files_our = st.file_uploader("Bizim Ekstreler", accept_multiple_files=True)
     files_their = st.file_uploader("Karşı Taraf Ekstreler", accept_multiple_files=True)
     st.divider()
-    pay_scenario = st.radio("Ödeme Eşleşme", ["Tarih + Ödeme No + Tutar", "Tarih + Belge Türü + Tutar"])
     analyze_btn = st.button("Analizi Başlat", type="primary", use_container_width=True)
 
 if files_our and files_their:
-    df_our = read_and_merge(files_our)
-    df_their = read_and_merge(files_their)
+    import reco_engine as eng
+    df_our, err_our = load_files(tuple((f.name, f.getvalue()) for f in files_our))
+    df_their, err_their = load_files(tuple((f.name, f.getvalue()) for f in files_their))
+    for e in err_our + err_their: st.error(e)
     
     if df_our.empty or df_their.empty:
         st.warning("Yüklenen dosyalardan biri boş veya okunamadı.")
     else:
-        saved_our = TemplateManager.find_best_match(files_our[0].name)
-        saved_their = TemplateManager.find_best_match(files_their[0].name)
+        saved_our = eng.TemplateManager.find_best_match(files_our[0].name)
+        saved_their = eng.TemplateManager.find_best_match(files_their[0].name)
         
         # PREVIEW (AYRI PENCERELER)
         c1, c2 = st.columns(2)
@@ -504,137 +255,49 @@ if files_our and files_their:
         with c1: map_our = render_mapping_ui("Bizim Taraf", df_our, saved_our, "our")
         with c2: map_their = render_mapping_ui("Karşı Taraf", df_their, saved_their, "their")
 
+        # Ödeme eşleştirme adımları karşı taraf şablonuyla birlikte saklanır
+        saved_passes = [p for p in saved_their.get("match_passes", eng.DEFAULT_MATCH_PASSES) if p in eng.MATCH_PASSES]
+        match_passes = st.multiselect("Ödeme Eşleştirme Adımları (seçim sırasıyla uygulanır)", list(eng.MATCH_PASSES.keys()),
+                                      default=saved_passes, format_func=lambda p: eng.MATCH_PASSES[p][0], key="match_passes")
+        map_their["match_passes"] = match_passes
+
         if analyze_btn:
+            if not map_our.get("inv_no") or not map_their.get("inv_no"):
+                st.error("HATA: 'Fatura No' seçimi zorunludur!")
+                st.stop()
+
             try:
-                if not map_our.get("inv_no") or not map_their.get("inv_no"):
-                    st.error("HATA: 'Fatura No' seçimi zorunludur!")
-                    st.stop()
-
-                TemplateManager.update_template(files_our[0].name, map_our)
-                TemplateManager.update_template(files_their[0].name, map_their)
-                
-                with st.spinner("Hesaplanıyor..."):
-                    prep_our = prepare_data(df_our, map_our, role)
-                    role_their = "Biz Satıcı" if role == "Biz Alıcı" else "Biz Alıcı"
-                    prep_their = prepare_data(df_their, map_their, role_their)
-                    
-                    # --- DEVİR MANTIĞI ---
-                    if calc_opening:
-                        t_open = pd.Timestamp(opening_date)
-                        mask_open_our = pd.to_datetime(prep_our["std_date"], errors='coerce').lt(t_open)
-                        if mask_open_our.any():
-                            open_bal_tl = prep_our.loc[mask_open_our, "Signed_TL"].sum()
-                            open_bal_fx = prep_our.loc[mask_open_our, "Signed_FX"].sum()
-                            prep_our = prep_our[~mask_open_our].copy()
-                            
-                            new_row = pd.DataFrame([{
-                                "Doc_Category": "ACILIS", 
-                                "Signed_TL": open_bal_tl,
-                                "Signed_FX": open_bal_fx,
-                                "std_date": t_open,
-                                "PB_Norm": "TL", 
-                                "Kaynak_Dosya": "DEVİR_BAKİYESİ",
-                                map_our["inv_no"]: "__ACILIS__"
-                            }])
-                            prep_our = pd.concat([new_row, prep_our], ignore_index=True)
-                    
-                    if "ACILIS" in prep_their["Doc_Category"].unique():
-                         prep_their.loc[prep_their["Doc_Category"]=="ACILIS", map_their["inv_no"]] = "__ACILIS__"
-                    
-                    prep_our["key_invoice_norm"] = prep_our[map_our["inv_no"]].apply(get_invoice_key)
-                    prep_our.loc[prep_our[map_our["inv_no"]] == "__ACILIS__", "key_invoice_norm"] = "__ACILIS__"
-
-                    prep_their["key_invoice_norm"] = prep_their[map_their["inv_no"]].apply(get_invoice_key)
-                    prep_their.loc[prep_their[map_their["inv_no"]] == "__ACILIS__", "key_invoice_norm"] = "__ACILIS__"
-
-                    ignored_our = prep_our[prep_our["Doc_Category"] == "DIGER"]
-                    ignored_their = prep_their[prep_their["Doc_Category"] == "DIGER"]
-
-                    # --- EŞLEŞTİRME ---
-                    inv_our = prep_our[prep_our["Doc_Category"].isin(["FATURA", "ACILIS"])]
-                    inv_their = prep_their[prep_their["Doc_Category"].isin(["FATURA", "ACILIS"])]
-                    
-                    def build_agg(mapping):
-                        agg = {"Signed_TL": "sum", "Signed_FX": "sum", "std_date": "max", "Kaynak_Dosya": "first", "Satır_No": "first"}
-                        if mapping.get("inv_no"): agg[mapping["inv_no"]] = "first"
-                        if mapping.get("pay_no"): agg[mapping["pay_no"]] = "first"
-                        if mapping.get("curr"): agg[mapping["curr"]] = "first" 
-                        for ec in mapping.get("extra_cols", []): agg[ec] = "first"
-                        return agg
-
-                    gk_our = ["key_invoice_norm"] + ([map_our["curr"]] if map_our["curr"] else [])
-                    gk_their = ["key_invoice_norm"] + ([map_their["curr"]] if map_their["curr"] else [])
-                    
-                    grp_our = inv_our.groupby(gk_our, as_index=False).agg(build_agg(map_our))
-                    grp_their = inv_their.groupby(gk_their, as_index=False).agg(build_agg(map_their))
-                    
-                    grp_our = force_suffix(grp_our, "_Biz", "key_invoice_norm")
-                    grp_their = force_suffix(grp_their, "_Onlar", "key_invoice_norm")
-                    
-                    merged_inv = pd.merge(grp_our, grp_their, on="key_invoice_norm", how="outer")
-                    
-                    def smart_diff(r, col_biz, col_onlar):
-                        v1 = r[col_biz] if pd.notna(r[col_biz]) else 0
-                        v2 = r[col_onlar] if pd.notna(r[col_onlar]) else 0
-                        if (v1 > 0 and v2 > 0) or (v1 < 0 and v2 < 0): return v1 - v2
-                        return v1 + v2
-
-                    merged_inv["Fark_TL"] = merged_inv.apply(lambda r: smart_diff(r, "Signed_TL_Biz", "Signed_TL_Onlar"), axis=1)
-                    merged_inv["Fark_FX"] = merged_inv.apply(lambda r: smart_diff(r, "Signed_FX_Biz", "Signed_FX_Onlar"), axis=1)
-
-                    # --- ÖDEME ---
-                    pay_our = prep_our[prep_our["Doc_Category"].str.contains("ODEME")].copy()
-                    pay_their = prep_their[prep_their["Doc_Category"].str.contains("ODEME")].copy()
-                    
-                    pay_our = pay_our.sort_values(by=["std_date", "Signed_TL"])
-                    pay_their = pay_their.sort_values(by=["std_date", "Signed_TL"])
-
-                    def create_pay_key(df, cfg, scenario):
-                        d = df["std_date"].apply(lambda x: x.strftime('%Y-%m-%d') if pd.notna(x) else '0000-00-00')
-                        a = df["Signed_TL"].abs().map('{:.2f}'.format)
-                        if "Ödeme No" in scenario:
-                            p = df[cfg["pay_no"]].astype(str) if cfg["pay_no"] else ""
-                            base_key = d + "_" + p + "_" + a
-                        else:
-                            cat = df["Doc_Category"].astype(str)
-                            base_key = d + "_" + cat + "_" + a
-                        df["_temp_rank"] = df.groupby(base_key).cumcount()
-                        return base_key + "_" + df["_temp_rank"].astype(str)
-
-                    pay_our["match_key"] = create_pay_key(pay_our, map_our, pay_scenario)
-                    pay_their["match_key"] = create_pay_key(pay_their, map_their, pay_scenario)
-                    
-                    pay_our = force_suffix(pay_our, "_Biz", "match_key")
-                    pay_their = force_suffix(pay_their, "_Onlar", "match_key")
-
-                    merged_pay = pd.merge(pay_our, pay_their, on="match_key", how="outer")
-                    merged_pay["Fark_TL"] = merged_pay.apply(lambda r: smart_diff(r, "Signed_TL_Biz", "Signed_TL_Onlar"), axis=1)
-                    merged_pay["Fark_FX"] = merged_pay.apply(lambda r: smart_diff(r, "Signed_FX_Biz", "Signed_FX_Onlar"), axis=1)
-
-                    # --- BAKİYE ---
-                    our_bal = prep_our.groupby("PB_Norm")[["Signed_TL", "Signed_FX"]].sum().reset_index()
-                    their_bal = prep_their.groupby("PB_Norm")[["Signed_TL", "Signed_FX"]].sum().reset_index()
-                    balance_summary = pd.merge(our_bal, their_bal, on="PB_Norm", how="outer", suffixes=("_Biz", "_Onlar")).fillna(0)
-                    balance_summary["Net_Fark_TL"] = balance_summary.apply(lambda r: smart_diff(r, "Signed_TL_Biz", "Signed_TL_Onlar"), axis=1)
-                    balance_summary["Net_Fark_FX"] = balance_summary.apply(lambda r: smart_diff(r, "Signed_FX_Biz", "Signed_FX_Onlar"), axis=1)
-
-                    st.session_state["res"] = {
-                        "inv_match": format_clean_view(merged_inv[merged_inv["Signed_TL_Biz"].notna() & merged_inv["Signed_TL_Onlar"].notna()], map_our, map_their, "FATURA"),
-                        "inv_bizde": format_clean_view(merged_inv[merged_inv["Signed_TL_Biz"].notna() & merged_inv["Signed_TL_Onlar"].isna()], map_our, map_their, "FATURA"),
-                        "inv_onlar": format_clean_view(merged_inv[merged_inv["Signed_TL_Biz"].isna() & merged_inv["Signed_TL_Onlar"].notna()], map_our, map_their, "FATURA"),
-                        "pay_match": format_clean_view(merged_pay, map_our, map_their, "ODEME"),
-                        "ignored_our": ignored_our, "ignored_their": ignored_their, "balance_summary": balance_summary,
-                        "prep_our": prep_our, "prep_their": prep_their, "merged_inv": merged_inv, "merged_pay": merged_pay,
-                        "map_our": map_our, "map_their": map_their
-                    }
+                eng.TemplateManager.update_template(files_our[0].name, map_our)
+                eng.TemplateManager.update_template(files_their[0].name, map_their)
+
+                submit_analysis(df_our, df_their, map_our, map_their, role,
+                                opening_date if calc_opening else None, match_passes)
             except Exception as e:
                 st.error(f"Hata: {str(e)}")
 
+# --- JOB DURUMU (rerun'lar sadece durumu okur, hesaplamayı tekrar etmez) ---
+job = st.session_state.get("job")
+if job is not None:
+    import reco_engine as eng
+    if job.done:
+        del st.session_state["job"]
+        try:
+            st.session_state["res"] = job.result()
+        except eng.JobCancelled:
+            st.info("Analiz iptal edildi.")
+        except Exception as e:
+            st.error(f"Hata: {str(e)}")
+    else:
+        job_status_panel()
+
 if "res" in st.session_state:
+    import pandas as pd
+    import reco_engine as eng
+    st.markdown(RESULT_CSS, unsafe_allow_html=True)
     res = st.session_state["res"]
     st.markdown("### 📊 Mutabakat Özeti")
     
-    summary_df = res["balance_summary"]
+    summary_df = eng.to_decimal(res["balance_summary"], ["Signed_TL_Biz", "Signed_TL_Onlar", "Net_Fark_TL", "Signed_FX_Biz", "Signed_FX_Onlar", "Net_Fark_FX"])
     rows = ""
     for _, r in summary_df.iterrows():
         c_fx = "pos-val" if r['Net_Fark_FX'] >= 0 else "neg-val"
@@ -657,6 +320,40 @@ if "res" in st.session_state:
     </table>
     """, unsafe_allow_html=True)
 
+    # --- YAŞLANDIRMA ---
+    aging_ref = st.date_input("Yaşlandırma Referans Tarihi", value=date.today(), key="aging_ref")
+    aging_df = pd.DataFrame()
+    if "aging_base" in res:
+        # Aynı tarih tekrar seçilirse hesap yapılmaz
+        if aging_ref not in res["aging_cache"]:
+            res["aging_cache"][aging_ref] = eng.compute_aging(res["aging_base"], aging_ref)
+        aging_df = res["aging_cache"][aging_ref]
+        aging_df = eng.to_decimal(aging_df, list(aging_df.columns[2:]))
+
+    if not aging_df.empty:
+        a_rows = ""
+        for _, r in aging_df.iterrows():
+            # TL satırı her zaman; döviz cinsi kalemlerde döviz kovaları ayrı satırda
+            kinds = [("TL", "TL")] + ([("FX", "Döviz")] if r['PB_Norm'] != "TL" else [])
+            for k, k_label in kinds:
+                cells = "".join([f"<td>{r[f'{k} {b}']:,.2f}</td>" for b in eng.AGING_BUCKETS])
+                a_rows += f"""<tr>
+            <td>{r['PB_Norm']}</td><td style="text-align:left">{r['Taraf']} ({k_label})</td>{cells}
+            <td class="border-left-thick">{r[f'{k} Toplam']:,.2f}</td>
+        </tr>"""
+        a_head = " ".join([f"<th>{b if b[0].isalpha() else b + ' Gün'}</th>" for b in eng.AGING_BUCKETS])
+        st.markdown(f"""
+    <table class="mini-table">
+        <thead>
+            <tr>
+                <th>PB</th> <th style="text-align:left">Açık Kalem</th> {a_head}
+                <th class="border-left-thick">Toplam</th>
+            </tr>
+        </thead>
+        <tbody>{a_rows}</tbody>
+    </table>
+    """, unsafe_allow_html=True)
+
     tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs(["✅ Fatura Eşleşme", "⚠️ Bizde Var/Yok", "⚠️ Onlarda Var/Yok", "💳 Ödemeler", "🔍 Analiz Dışı", "📝 Analiz Yorum", "📥 İndir"])
     
     with tab1: st.data_editor(res["inv_match"], use_container_width=True, disabled=True, key="t1")
@@ -665,8 +362,8 @@ if "res" in st.session_state:
     with tab4: st.data_editor(res["pay_match"], use_container_width=True, disabled=True, key="t4")
     with tab5: 
         c1,c2=st.columns(2)
-        with c1: st.write("Bizim Kapsam Dışı"); st.dataframe(res["ignored_our"])
-        with c2: st.write("Onların Kapsam Dışı"); st.dataframe(res["ignored_their"])
+        with c1: st.write("Bizim Kapsam Dışı"); st.dataframe(eng.to_decimal(res["ignored_our"], ["Signed_TL", "Signed_FX"]))
+        with c2: st.write("Onların Kapsam Dışı"); st.dataframe(eng.to_decimal(res["ignored_their"], ["Signed_TL", "Signed_FX"]))
         
     with tab6:
         st.subheader("📅 Tarih Bazlı Mutabakat Analizi")
@@ -714,7 +411,7 @@ if "res" in st.session_state:
                 col_name = map_cfg.get("doc_type")
                 if not col_name or col_name not in df_f.columns: return []
                 grp = df_f.groupby(col_name)[["Signed_TL", "Signed_FX"]].sum().reset_index()
-                return [f"{r[col_name]}: {r['Signed_TL']:,.2f} TL / {r['Signed_FX']:,.2f} FX" for _, r in grp.iterrows()]
+                return [f"{r[col_name]}: {r['Signed_TL'] / eng.AMOUNT_SCALE:,.2f} TL / {r['Signed_FX'] / eng.AMOUNT_SCALE:,.2f} FX" for _, r in grp.iterrows()]
 
             ign_list_our = get_ign_sum(res["ignored_our"], res["map_our"])
             ign_list_their = get_ign_sum(res["ignored_their"], res["map_their"])
@@ -728,6 +425,12 @@ if "res" in st.session_state:
             ign_html_our = "".join([f"<li class='sub-list'>{x}</li>" for x in ign_list_our]) or "<li class='sub-list'>Yok</li>"
             ign_html_their = "".join([f"<li class='sub-list'>{x}</li>" for x in ign_list_their]) or "<li class='sub-list'>Yok</li>"
 
+            # Kuruş -> ondalık (sadece gösterim)
+            bal_our, bal_their, diff_total, open_diff_tl, miss_them, miss_us, \
+                match_inv_diff_tl, match_inv_diff_fx, match_pay_diff_tl, match_pay_diff_fx = [
+                    v / eng.AMOUNT_SCALE for v in (bal_our, bal_their, diff_total, open_diff_tl, miss_them, miss_us,
+                                               match_inv_diff_tl, match_inv_diff_fx, match_pay_diff_tl, match_pay_diff_fx)]
+
             st.markdown(f"""
             <div class="commentary-box">
                 <div class="commentary-header">📌 {target_date.strftime('%d.%m.%Y')} Tarihli Mutabakat Raporu</div>
@@ -755,13 +458,10 @@ if "res" in st.session_state:
             """, unsafe_allow_html=True)
 
     with tab7:
-        output = BytesIO()
-        writer = pd.ExcelWriter(output, engine='xlsxwriter')
-        res["balance_summary"].to_excel(writer, sheet_name='Ozet', index=False)
-        res["inv_match"].to_excel(writer, sheet_name='Fatura_Eslesme', index=False)
-        res["inv_bizde"].to_excel(writer, sheet_name='Bizde_Var_Onlarda_Yok', index=False)
-        res["inv_onlar"].to_excel(writer, sheet_name='Onlarda_Var_Bizde_Yok', index=False)
-        res["pay_match"].to_excel(writer, sheet_name='Odeme_Eslesme', index=False)
-        writer.close()
-        st.download_button("Excel İndir", output.getvalue(), "RecoMatch_Rapor.xlsx")
+        # Excel sadece istenince üretilir (xlsxwriter o an yüklenir); aynı sonuç/tarih için tekrar üretilmez
+        xls_cache = res.setdefault("excel_cache", {})
+        if aging_ref not in xls_cache and st.button("Excel Raporu Hazırla"):
+            xls_cache[aging_ref] = eng.build_excel_report(summary_df, res, aging_df)
+        if aging_ref in xls_cache:
+            st.download_button("Excel İndir", xls_cache[aging_ref], "RecoMatch_Rapor.xlsx")
 
@@ -0,0 +1,93 @@
+"""Başlangıç / rerun süresi ölçümü (önce/sonra).
+
+    python bench_startup.py [--base <git-ref>] [--reruns 20] [--repeat 3]
+
+1) Soğuk import: her modül ayrı, temiz bir süreçte import edilir (streamlit, pandas, numpy, reco_engine).
+2) Boş sayfa: app.py AppTest ile temiz bir süreçte ilk kez çalıştırılır, sonra dosya yüklenmeden N kez rerun edilir.
+   Aynı ölçüm --base ref'indeki app.py (git show) için de yapılır ve yan yana basılır.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+HEAVY = ("pandas", "numpy", "reco_engine", "openpyxl", "xlsxwriter")
+
+IMPORT_SNIPPET = """
+import sys, time
+t0 = time.perf_counter(); __import__(sys.argv[1]); print(time.perf_counter() - t0)
+"""
+
+def cold_import(module, repeat):
+    times = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET, module], cwd=HERE,
+                             capture_output=True, text=True, check=True)
+        times.append(float(out.stdout))
+    return statistics.median(times)
+
+def run_app_worker(app_path, reruns):
+    """Ayrı süreçte çalışır: AppTest ilk çalıştırma + boş sayfa rerun süreleri."""
+    import time
+    from streamlit.testing.v1 import AppTest
+    before = set(sys.modules)
+    at = AppTest.from_file(app_path, default_timeout=60)
+    t0 = time.perf_counter(); at.run(); first = time.perf_counter() - t0
+    times = []
+    for _ in range(reruns):
+        t0 = time.perf_counter(); at.run(); times.append(time.perf_counter() - t0)
+    loaded = [m for m in HEAVY if m in sys.modules and m not in before]
+    print(json.dumps({"first": first, "rerun": statistics.median(times), "loaded": loaded}))
+
+def measure_app(app_path, reruns, repeat):
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", app_path, "--reruns", str(reruns)],
+                             cwd=os.path.dirname(app_path), capture_output=True, text=True, check=True)
+        runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {
+        "first": statistics.median(r["first"] for r in runs),
+        "rerun": statistics.median(r["rerun"] for r in runs),
+        "loaded": runs[-1]["loaded"],
+    }
+
+def baseline_ref():
+    out = subprocess.run(["git", "rev-list", "--max-parents=0", "HEAD"], cwd=HERE, capture_output=True, text=True, check=True)
+    return out.stdout.split()[0]
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--base", default=None, help="karşılaştırılacak git ref (varsayılan: ilk commit)")
+    ap.add_argument("--reruns", type=int, default=20)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.worker:
+        run_app_worker(args.worker, args.reruns)
+        return
+
+    print("Soğuk import (temiz süreç, medyan):")
+    for m in ("streamlit", "pandas", "numpy", "reco_engine"):
+        print(f"  {m:<12} {cold_import(m, args.repeat) * 1000:8.1f} ms")
+
+    base = args.base or baseline_ref()
+    with tempfile.TemporaryDirectory() as tmp:
+        base_app = os.path.join(tmp, "app.py")
+        src = subprocess.run(["git", "show", f"{base}:app.py"], cwd=HERE, capture_output=True, check=True).stdout
+        with open(base_app, "wb") as f: f.write(src)
+        res_base = measure_app(base_app, args.reruns, args.repeat)
+    res_new = measure_app(os.path.join(HERE, "app.py"), args.reruns, args.repeat)
+
+    print(f"\nBoş sayfa (AppTest, {args.repeat} süreç medyanı, rerun n={args.reruns}):")
+    print(f"  {'':<22}{'önce (' + base[:7] + ')':>16}{'sonra':>12}")
+    print(f"  {'ilk çalıştırma':<22}{res_base['first'] * 1000:13.1f} ms{res_new['first'] * 1000:9.1f} ms")
+    print(f"  {'rerun medyan':<22}{res_base['rerun'] * 1000:13.1f} ms{res_new['rerun'] * 1000:9.1f} ms")
+    print(f"  {'yüklenen ağır modül':<22}{', '.join(res_base['loaded']) or '-':>16}{', '.join(res_new['loaded']) or '-':>12}")
+
+if __name__ == "__main__":
+    main()
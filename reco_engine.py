@@ -0,0 +1,654 @@
+"""RecoMatch hesaplama motoru.
+
+Streamlit her etkileşimde app.py'yi baştan çalıştırır; bu modül ise ilk importta bir kez yüklenir
+(sys.modules) ve rerun'larda tekrar çalışmaz. Excel okuma/yazma motorları sadece gerektiğinde yüklenir.
+"""
+import json
+import os
+import re
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+from decimal import Decimal, ROUND_HALF_UP
+
+import numpy as np
+import pandas as pd
+
+# ==========================================
+# 1. TEMPLATE MANAGER
+# ==========================================
+TEMPLATE_FILE = "recomatch_memory.json"
+
+class TemplateManager:
+    @staticmethod
+    def load():
+        if os.path.exists(TEMPLATE_FILE):
+            try:
+                with open(TEMPLATE_FILE, "r", encoding="utf-8") as f: return json.load(f)
+            except: return {}
+        return {}
+
+    @staticmethod
+    def update_template(filename, mapping):
+        templates = TemplateManager.load()
+        key = filename.split('_')[0].lower()
+        if len(key) < 3: key = filename.lower()
+        templates[key] = mapping
+        with open(TEMPLATE_FILE, "w", encoding="utf-8") as f:
+            json.dump(templates, f, ensure_ascii=False, indent=2)
+
+    @staticmethod
+    def find_best_match(filename):
+        templates = TemplateManager.load()
+        for key, val in templates.items():
+            if key in filename.lower(): return val
+        return {}
+
+# ==========================================
+# 2. YARDIMCI FONKSİYONLAR
+# ==========================================
+def normalize_text(s):
+    if pd.isna(s): return ""
+    s = str(s).strip().upper()
+    s = s.replace(" ", "").replace("O", "0")
+    return s
+
+def normalize_currency(val):
+    if pd.isna(val): return "TL"
+    s = str(val).strip().upper().replace(" ", "").replace(".", "")
+    if s in ["TRY", "TRL", "TURKLIRASI", "TÜRKLIRASI", "TL", "YTL"]: return "TL"
+    if s in ["USD", "ABDDOLARI", "USDOLLAR", "DOLAR", "$"]: return "USD"
+    if s in ["EUR", "EURO", "AVRO", "€"]: return "EUR"
+    if s in ["GBP", "STERLIN", "£"]: return "GBP"
+    if s in ["CHF", "ISVICREFRANGI"]: return "CHF"
+    return s
+
+def get_invoice_key(raw_val):
+    val_str = str(raw_val)
+    if val_str.endswith('.0'): val_str = val_str[:-2]
+    clean = re.sub(r'[^A-Z0-9]', '', normalize_text(val_str))
+    return clean
+
+# Tutarlar içeride int64 kuruş/cent (minor unit) olarak tutulur; ekrana/Excel'e basarken AMOUNT_SCALE'e bölünür
+AMOUNT_SCALE = 100
+
+def parse_amount(val):
+    """Metin tutarı float'a uğramadan doğrudan kuruş (int) olarak çözer. '1.234,56' -> 123456"""
+    if pd.isna(val) or val == "": return 0
+    if isinstance(val, (int, float)):
+        # Metin yolu ile aynı kural: 3. hanede yarım yukarı (float round() banker's rounding yapar)
+        return int(Decimal(str(val)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP) * AMOUNT_SCALE)
+    s = str(val).strip()
+    is_neg = s.startswith("-") or ("(" in s and ")" in s)
+    s = re.sub(r"[^\d.,]", "", s)
+    if not s: return 0
+    if "," in s and "." in s:
+        if s.rfind(",") > s.rfind("."): s = s.replace(".", "").replace(",", ".")
+        else: s = s.replace(",", "")
+    elif "," in s: s = s.replace(",", ".")
+    if s.count(".") > 1: return 0
+    whole, _, frac = s.partition(".")
+    if not whole and not frac: return 0
+    minor = int(whole or 0) * AMOUNT_SCALE + int((frac + "00")[:2])
+    if len(frac) > 2 and frac[2] >= "5": minor += 1  # 3. hane yuvarlama
+    return -minor if is_neg else minor
+
+def to_decimal(df, cols):
+    """Kuruş kolonlarını gösterim/Excel için ondalık tutara çevirir (kopya döner)."""
+    df = df.copy()
+    for c in cols:
+        if c in df.columns: df[c] = df[c] / AMOUNT_SCALE
+    return df
+
+def smart_date_parser(val):
+    if pd.isna(val) or val == "": return pd.NaT
+    if isinstance(val, pd.Timestamp): return val
+    s = str(val).strip()
+    if s.isdigit() or (s.replace('.', '', 1).isdigit() and float(s) > 30000):
+         try: return pd.to_datetime(float(s), unit='D', origin='1899-12-30')
+         except: pass
+    formats = ['%d.%m.%Y', '%Y-%m-%d', '%d-%m-%Y', '%Y.%m.%d', '%d/%m/%Y', '%m/%d/%Y']
+    for fmt in formats:
+        try: return pd.to_datetime(s, format=fmt)
+        except: continue
+    try: return pd.to_datetime(s, dayfirst=True)
+    except: return pd.NaT
+
+# ==========================================
+# 3. HESAPLAMA MANTIĞI
+# ==========================================
+def calculate_smart_balance(row, role, 
+                            mode_tl, c_tl_debt, c_tl_credit, c_tl_single, is_tl_signed,
+                            mode_fx, c_fx_debt, c_fx_credit, c_fx_single, is_fx_signed,
+                            doc_cat):
+    
+    calc_sign = 1
+    if role == "Biz Alıcı":
+        if doc_cat in ["FATURA", "IADE_ODEME"]: calc_sign = 1 
+        else: calc_sign = -1 
+    else: # Biz Satıcı
+        if doc_cat in ["FATURA", "IADE_ODEME"]: calc_sign = -1 
+        else: calc_sign = 1 
+
+    # --- TL ---
+    tl_debt_val = 0
+    tl_credit_val = 0
+    tl_net = 0
+    
+    if mode_tl == "separate":
+        tl_debt_val = parse_amount(row.get(c_tl_debt, 0))
+        tl_credit_val = parse_amount(row.get(c_tl_credit, 0))
+        tl_net = tl_credit_val - tl_debt_val
+    else:
+        raw_tl = parse_amount(row.get(c_tl_single, 0))
+        if is_tl_signed: tl_net = raw_tl
+        else: tl_net = raw_tl * calc_sign
+
+    # --- FX ---
+    fx_net = 0
+    if mode_fx == "separate":
+        f_d = parse_amount(row.get(c_fx_debt, 0))
+        f_c = parse_amount(row.get(c_fx_credit, 0))
+        fx_net = f_c - f_d
+    elif mode_fx == "single":
+        raw_fx = parse_amount(row.get(c_fx_single, 0))
+        if raw_fx != 0:
+            if is_fx_signed:
+                fx_net = raw_fx
+            else:
+                if mode_tl == "separate":
+                    if tl_debt_val > 0: fx_net = -abs(raw_fx)
+                    elif tl_credit_val > 0: fx_net = abs(raw_fx)
+                    else: fx_net = raw_fx * calc_sign
+                elif mode_tl == "single" and is_tl_signed:
+                    if tl_net < 0: fx_net = -abs(raw_fx)
+                    elif tl_net > 0: fx_net = abs(raw_fx)
+                    else: fx_net = raw_fx * calc_sign
+                else:
+                    fx_net = raw_fx * calc_sign
+
+    return tl_net, fx_net
+
+def get_doc_category(val, cfg):
+    val = normalize_text(val)
+    if val in [normalize_text(x) for x in cfg.get("FATURA", [])]: return "FATURA"
+    elif val in [normalize_text(x) for x in cfg.get("ODEME", [])]: return "ODEME"
+    elif val in [normalize_text(x) for x in cfg.get("IADE_FATURA", [])]: return "IADE_FATURA"
+    elif val in [normalize_text(x) for x in cfg.get("IADE_ODEME", [])]: return "IADE_ODEME"
+    if val in [normalize_text(x) for x in cfg.get("ACILIS", [])]: return "ACILIS"
+    return "DIGER"
+
+PREP_CHUNK = 5000
+
+def _chunked_apply(obj, func, check, **kwargs):
+    # Satır bazlı apply'ı PREP_CHUNK'lık parçalara böler; her parçadan önce iptal kontrolü
+    parts = []
+    for i in range(0, len(obj), PREP_CHUNK):
+        check()
+        parts.append(obj.iloc[i:i + PREP_CHUNK].apply(func, **kwargs))
+    return pd.concat(parts)
+
+def prepare_data(df, mapping, role, check=None):
+    """check: iptal kontrolü (iptal edildiyse hata fırlatır); satır bazlı hesap parçalar halinde yapılıp araya konur."""
+    if df.empty: return df
+    if check is None: check = lambda: None
+    df = df.copy()
+    c_date = mapping.get("date")
+    if c_date and c_date in df.columns:
+        # Parçalar arası dtype farkı olmasın (tamamı NaT olan parça object döner)
+        df["std_date"] = pd.to_datetime(_chunked_apply(df[c_date], smart_date_parser, check), errors='coerce')
+    else: df["std_date"] = pd.NaT
+    check()
+
+    c_type = mapping.get("doc_type")
+    type_cfg = mapping.get("type_vals", {})
+    if c_type and c_type in df.columns:
+        df["Doc_Category"] = df[c_type].apply(lambda x: get_doc_category(x, type_cfg))
+    else: df["Doc_Category"] = "DIGER"
+
+    def wrapper(r):
+        return calculate_smart_balance(
+            r, role,
+            mapping.get("amount_mode", "single"), 
+            mapping.get("col_debt"), mapping.get("col_credit"), mapping.get("col_amount"), mapping.get("is_tl_signed"),
+            mapping.get("fx_amount_mode", "none"),
+            mapping.get("col_fx_debt"), mapping.get("col_fx_credit"), mapping.get("col_fx_amount"), mapping.get("is_fx_signed"),
+            r["Doc_Category"]
+        )
+    
+    res = _chunked_apply(df, wrapper, check, axis=1, result_type='expand')
+    df["Signed_TL"] = res[0].astype(np.int64)
+    df["Signed_FX"] = res[1].astype(np.int64)
+
+    c_curr = mapping.get("curr")
+    if c_curr and c_curr in df.columns:
+        df["PB_Norm"] = df[c_curr].apply(normalize_currency)
+        df["PB_Norm"] = df["PB_Norm"].replace("", "TL").fillna("TL")
+    else: df["PB_Norm"] = "TL"
+
+    c_inv = mapping.get("inv_no")
+    if c_inv and c_inv in df.columns:
+        df["key_invoice_norm"] = df[c_inv].apply(get_invoice_key)
+    else: df["key_invoice_norm"] = ""
+    return df
+
+# --- YAŞLANDIRMA (AGING) ---
+AGING_BUCKETS = ["0-30", "31-60", "61-90", "90+", "İleri Tarihli", "Tarihsiz"]
+AGING_NO_DATE = np.iinfo(np.int64).max
+AGING_SIDES = {"BIZDE": "Bizde Var / Onlarda Yok", "ONLAR": "Onlarda Var / Bizde Yok", "FARK": "Eşleşen (Kalan Fark)"}
+
+def build_aging_base(merged_inv):
+    """Açık kalemleri (Taraf, PB, tarih) sırasıyla BİR KEZ sıralar; referans tarihi değişince sadece searchsorted yapılır."""
+    cols = ["Taraf", "PB_Norm", "day", "Fark_TL", "Fark_FX"]
+    if merged_inv.empty: return {"df": pd.DataFrame(columns=cols), "groups": []}
+    m = merged_inv[merged_inv["key_invoice_norm"] != "__ACILIS__"]
+    has_biz, has_onlar = m["Signed_TL_Biz"].notna(), m["Signed_TL_Onlar"].notna()
+    side = np.select([has_biz & ~has_onlar, ~has_biz & has_onlar], ["BIZDE", "ONLAR"], default="FARK")
+
+    d_biz = pd.to_datetime(m["std_date_Biz"], errors='coerce')
+    d_onlar = pd.to_datetime(m["std_date_Onlar"], errors='coerce')
+    d = d_biz.where(has_biz, d_onlar).fillna(d_onlar)
+    pb_biz = m["PB_Norm_Biz"] if "PB_Norm_Biz" in m.columns else pd.Series("TL", index=m.index)
+    pb_onlar = m["PB_Norm_Onlar"] if "PB_Norm_Onlar" in m.columns else pd.Series("TL", index=m.index)
+
+    base = pd.DataFrame({
+        "Taraf": side,
+        "PB_Norm": pb_biz.where(has_biz, pb_onlar).fillna("TL").values,
+        # Tarihsiz kalemler sıralamada en sona düşer, compute_aging'de "Tarihsiz" kovasına girer
+        "day": np.where(d.notna(), d.values.astype("datetime64[D]").astype(np.int64), AGING_NO_DATE),
+        "Fark_TL": m["Fark_TL"].fillna(0).astype(np.int64).values,
+        "Fark_FX": m["Fark_FX"].fillna(0).astype(np.int64).values,
+    }, columns=cols)
+    base = base[(base["Fark_TL"] != 0) | (base["Fark_FX"] != 0)]
+    base = base.sort_values(["Taraf", "PB_Norm", "day"], kind="mergesort").reset_index(drop=True)
+
+    groups = []
+    if not base.empty:
+        key = base["Taraf"] + "|" + base["PB_Norm"]
+        starts = np.flatnonzero(np.r_[True, key.values[1:] != key.values[:-1]])
+        ends = np.r_[starts[1:], len(base)]
+        groups = [(base.at[s, "Taraf"], base.at[s, "PB_Norm"], s, e) for s, e in zip(starts, ends)]
+    return {
+        "df": base, "groups": groups,
+        "cs_tl": np.r_[0, base["Fark_TL"].cumsum().values].astype(np.int64),
+        "cs_fx": np.r_[0, base["Fark_FX"].cumsum().values].astype(np.int64),
+    }
+
+def compute_aging(aging_base, ref_date):
+    """Referans tarihine göre Taraf x PB bazında gün kovaları (TL ve FX, kuruş).
+    Referans tarihinden sonraki ve tarihsiz kalemler ayrı kovalarda; toplam tüm açık kalemlere eşittir."""
+    out_cols = ["Taraf", "PB_Norm"] + [f"TL {b}" for b in AGING_BUCKETS] + ["TL Toplam"] + [f"FX {b}" for b in AGING_BUCKETS] + ["FX Toplam"]
+    if not aging_base["groups"]: return pd.DataFrame(columns=out_cols)
+    ref = np.datetime64(pd.Timestamp(ref_date).date(), "D").astype(np.int64)
+    days = aging_base["df"]["day"].values
+    cs_tl, cs_fx = aging_base["cs_tl"], aging_base["cs_fx"]
+    # Sıralı dizide kova sınırları: [.. ref-91] [ref-90 .. ref-61] [ref-60 .. ref-31] [ref-30 .. ref] [ref+1 ..] [tarihsiz]
+    edges = np.array([ref - 90, ref - 60, ref - 30, ref + 1, AGING_NO_DATE])
+
+    rows = []
+    for taraf, pb, s, e in aging_base["groups"]:
+        pos = s + np.searchsorted(days[s:e], edges, side="left")
+        cut = np.r_[s, pos, e]  # [90+, 61-90, 31-60, 0-30, ileri tarihli, tarihsiz] sırasıyla
+        order = [3, 2, 1, 0, 4, 5]
+        tl = (cs_tl[cut[1:]] - cs_tl[cut[:-1]])[order]
+        fx = (cs_fx[cut[1:]] - cs_fx[cut[:-1]])[order]
+        rows.append([AGING_SIDES[taraf], pb, *tl, tl.sum(), *fx, fx.sum()])
+    return pd.DataFrame(rows, columns=out_cols)
+
+# --- EŞLEŞTİRME ADIMLARI (MATCH PASSES) ---
+# Her adım sadece önceki adımlarda eşleşmeyen satırları kullanır. Değer: (etiket, join kolonları)
+MATCH_PASSES = {
+    "date_key_amount":  ("Tarih + Ödeme No + Tutar", ["_k_date", "_k_ref", "_k_amt"]),
+    "date_type_amount": ("Tarih + Belge Türü + Tutar", ["_k_date", "_k_type", "_k_amt"]),
+    "exact_key":        ("Ödeme No", ["_k_ref"]),
+    "key_amount":       ("Ödeme No + Tutar", ["_k_ref", "_k_amt"]),
+    "date_amount":      ("Tarih + Tutar", ["_k_date", "_k_amt"]),
+    "ref_in_desc":      ("Referans Açıklamada + Tutar", None),
+}
+DEFAULT_MATCH_PASSES = ["date_key_amount", "key_amount", "date_amount", "ref_in_desc"]
+MIN_REF_LEN = 4
+
+def build_match_keys(df, cfg):
+    """Eşleştirme anahtarları: gün sayısı, normalize ödeme no/açıklama, belge türü, |tutar| (kuruş)."""
+    d = pd.to_datetime(df["std_date"], errors='coerce')
+    c_pay = cfg.get("pay_no")
+    return pd.DataFrame({
+        "_k_date": np.where(d.notna(), d.values.astype("datetime64[D]").astype(np.int64), -1),
+        "_k_ref": df[c_pay].apply(get_invoice_key) if c_pay and c_pay in df.columns else "",
+        "_k_type": df["Doc_Category"].astype(str),
+        "_k_amt": df["Signed_TL"].abs().astype(np.int64),
+    }, index=df.index)
+
+def _match_on_keys(k_l, k_r, cols):
+    if "_k_ref" in cols:
+        k_l, k_r = k_l[k_l["_k_ref"] != ""], k_r[k_r["_k_ref"] != ""]
+    # Aynı anahtarda birden fazla satır varsa sırayla 1-1 eşleşsin
+    l = k_l[cols].assign(_rank=k_l.groupby(cols).cumcount().values, idx_l=k_l.index)
+    r = k_r[cols].assign(_rank=k_r.groupby(cols).cumcount().values, idx_r=k_r.index)
+    return pd.merge(l, r, on=cols + ["_rank"], how="inner")[["idx_l", "idx_r"]]
+
+def _match_ref_in_desc(k_l, k_r):
+    # Aday çiftler sadece aynı tutardakiler; sonra metin içerme kontrolü
+    l = k_l[k_l["_k_ref"].str.len() >= MIN_REF_LEN][["_k_ref", "_k_amt"]].assign(idx_l=lambda x: x.index, _pos_l=lambda x: np.arange(len(x)))
+    r = k_r[k_r["_k_ref"].str.len() >= MIN_REF_LEN][["_k_ref", "_k_amt"]].assign(idx_r=lambda x: x.index, _pos_r=lambda x: np.arange(len(x)))
+    cand = pd.merge(l, r, on="_k_amt", suffixes=("_l", "_r"))
+    if cand.empty: return cand[["idx_l", "idx_r"]]
+    hit = [a in b or b in a for a, b in zip(cand["_k_ref_l"].values, cand["_k_ref_r"].values)]
+    cand = cand[hit].sort_values(["_pos_l", "_pos_r"], kind="mergesort")
+    # 1-1 atama: tarih sırasıyla her sol satıra henüz kullanılmamış ilk sağ satır
+    used_l, used_r, pairs = set(), set(), []
+    for il, ir in zip(cand["idx_l"].values, cand["idx_r"].values):
+        if il in used_l or ir in used_r: continue
+        used_l.add(il); used_r.add(ir); pairs.append((il, ir))
+    return pd.DataFrame(pairs, columns=["idx_l", "idx_r"])
+
+def run_match_passes(df_l, df_r, cfg_l, cfg_r, passes):
+    """Sıralı adımlarla eşleştirir. Dönen: (çiftler[idx_l, idx_r, Eşleşme_Kuralı], kalan_sol_idx, kalan_sağ_idx)"""
+    k_l, k_r = build_match_keys(df_l, cfg_l), build_match_keys(df_r, cfg_r)
+    rem_l, rem_r = df_l.index, df_r.index
+    pairs = []
+    for p in passes:
+        if p not in MATCH_PASSES: continue
+        if rem_l.empty or rem_r.empty: break
+        label, cols = MATCH_PASSES[p]
+        # Index bazlı anti-join: sadece kalan satırlar
+        cur_l, cur_r = k_l.loc[rem_l], k_r.loc[rem_r]
+        m = _match_ref_in_desc(cur_l, cur_r) if cols is None else _match_on_keys(cur_l, cur_r, cols)
+        if m.empty: continue
+        pairs.append(m.assign(Eşleşme_Kuralı=label))
+        # isin maskesi sırayı korur (difference index'i sıralar); kalanlar tarih/tutar sırasında kalmalı
+        rem_l = rem_l[~rem_l.isin(m["idx_l"])]
+        rem_r = rem_r[~rem_r.isin(m["idx_r"])]
+    pairs = pd.concat(pairs, ignore_index=True) if pairs else pd.DataFrame(columns=["idx_l", "idx_r", "Eşleşme_Kuralı"])
+    return pairs, rem_l, rem_r
+
+# ==========================================
+# 4. GÖRÜNTÜ FORMATLAYICI
+# ==========================================
+AMOUNT_COLS_MERGED = ["Signed_TL_Biz", "Signed_FX_Biz", "Signed_TL_Onlar", "Signed_FX_Onlar", "Fark_TL", "Fark_FX"]
+
+def format_clean_view(df, map_our, map_their, type="FATURA"):
+    if df.empty: return df
+    df = to_decimal(df, AMOUNT_COLS_MERGED)
+    
+    if "std_date_Biz" in df.columns:
+        df["std_date_Biz"] = pd.to_datetime(df["std_date_Biz"], errors='coerce').dt.strftime('%d.%m.%Y')
+    if "std_date_Onlar" in df.columns:
+        df["std_date_Onlar"] = pd.to_datetime(df["std_date_Onlar"], errors='coerce').dt.strftime('%d.%m.%Y')
+
+    cols_our, rename_our = [], {}
+    if "Kaynak_Dosya_Biz" in df.columns: cols_our.append("Kaynak_Dosya_Biz"); rename_our["Kaynak_Dosya_Biz"] = "Kaynak (Biz)"
+    
+    our_inv = map_our.get("inv_no")
+    if our_inv and (our_inv + "_Biz") in df.columns:
+        cols_our.append(our_inv + "_Biz")
+        rename_our[our_inv + "_Biz"] = "Fatura No (Biz)" if type == "FATURA" else "İlgili Fatura (Biz)"
+
+    our_pay = map_our.get("pay_no")
+    if type != "FATURA" and our_pay and (our_pay + "_Biz") in df.columns:
+        cols_our.append(our_pay + "_Biz")
+        rename_our[our_pay + "_Biz"] = "Ödeme/Açık. (Biz)"
+
+    cols_our.extend(["std_date_Biz", "Signed_TL_Biz", "Signed_FX_Biz"])
+    rename_our.update({"std_date_Biz": "Tarih (Biz)", "Signed_TL_Biz": "Tutar TL (Biz)", "Signed_FX_Biz": "Tutar FX (Biz)"})
+    
+    if map_our.get("curr") and (map_our.get("curr")+"_Biz" in df.columns):
+        cols_our.append(map_our.get("curr")+"_Biz"); rename_our[map_our.get("curr")+"_Biz"] = "PB (Biz)"
+        
+    for ec in map_our.get("extra_cols", []):
+        if (ec+"_Biz") in df.columns:
+            cols_our.append(ec+"_Biz"); rename_our[ec+"_Biz"] = f"{ec} (Biz)"
+
+    cols_their, rename_their = [], {}
+    if "Kaynak_Dosya_Onlar" in df.columns: cols_their.append("Kaynak_Dosya_Onlar"); rename_their["Kaynak_Dosya_Onlar"] = "Kaynak (Onlar)"
+
+    their_inv = map_their.get("inv_no")
+    if their_inv and (their_inv + "_Onlar") in df.columns:
+        cols_their.append(their_inv + "_Onlar")
+        rename_their[their_inv + "_Onlar"] = "Fatura No (Onlar)" if type == "FATURA" else "İlgili Fatura (Onlar)"
+
+    their_pay = map_their.get("pay_no")
+    if type != "FATURA" and their_pay and (their_pay + "_Onlar") in df.columns:
+        cols_their.append(their_pay + "_Onlar")
+        rename_their[their_pay + "_Onlar"] = "Ödeme/Açık. (Onlar)"
+
+    cols_their.extend(["std_date_Onlar", "Signed_TL_Onlar", "Signed_FX_Onlar"])
+    rename_their.update({"std_date_Onlar": "Tarih (Onlar)", "Signed_TL_Onlar": "Tutar TL (Onlar)", "Signed_FX_Onlar": "Tutar FX (Onlar)"})
+
+    if map_their.get("curr") and (map_their.get("curr")+"_Onlar" in df.columns):
+        cols_their.append(map_their.get("curr")+"_Onlar"); rename_their[map_their.get("curr")+"_Onlar"] = "PB (Onlar)"
+
+    for ec in map_their.get("extra_cols", []):
+        if (ec+"_Onlar") in df.columns:
+            cols_their.append(ec+"_Onlar"); rename_their[ec+"_Onlar"] = f"{ec} (Onlar)"
+
+    final_cols = cols_our + cols_their + ["Fark_TL", "Fark_FX", "Eşleşme_Kuralı"]
+    final_rename = {**rename_our, **rename_their, "Fark_TL": "Fark (TL)", "Fark_FX": "Fark (FX)", "Eşleşme_Kuralı": "Eşleşme Kuralı"}
+    
+    existing = [c for c in final_cols if c in df.columns]
+    out_df = df[existing].rename(columns=final_rename)
+    if out_df.empty: return pd.DataFrame()
+    return out_df
+
+# ==========================================
+# 5. ANALİZ ZİNCİRİ
+# ==========================================
+def force_suffix(df, suffix, key_col):
+    keys = key_col if isinstance(key_col, list) else [key_col]
+    new_cols = {}
+    for c in df.columns:
+        if c in keys: continue
+        new_cols[c] = f"{c}{suffix}"
+    return df.rename(columns=new_cols)
+
+def smart_diff(df, col_biz, col_onlar):
+    """Kuruş bazında akıllı fark: aynı işaretliyse v1 - v2, değilse v1 + v2. Sonuç int64, küsürat hatası yok."""
+    v1 = df[col_biz].fillna(0).round().astype(np.int64).values
+    v2 = df[col_onlar].fillna(0).round().astype(np.int64).values
+    same_sign = ((v1 > 0) & (v2 > 0)) | ((v1 < 0) & (v2 < 0))
+    return pd.Series(np.where(same_sign, v1 - v2, v1 + v2), index=df.index)
+
+def run_analysis(df_our, df_their, map_our, map_their, role, opening_date, match_passes, progress=None, check=None):
+    """Tüm hesaplama zinciri (hazırlık, devir, fatura/ödeme eşleştirme, bakiye). opening_date None ise devir hesaplanmaz."""
+    if progress is None: progress = lambda stage, rows: None
+    if check is None: check = lambda: None
+    check()
+    prep_our = prepare_data(df_our, map_our, role, check)
+    progress("Hazırlık (Biz)", len(prep_our))
+    role_their = "Biz Satıcı" if role == "Biz Alıcı" else "Biz Alıcı"
+    prep_their = prepare_data(df_their, map_their, role_their, check)
+    progress("Hazırlık (Onlar)", len(prep_their))
+    
+    # --- DEVİR MANTIĞI ---
+    if opening_date is not None:
+        t_open = pd.Timestamp(opening_date)
+        mask_open_our = pd.to_datetime(prep_our["std_date"], errors='coerce').lt(t_open)
+        if mask_open_our.any():
+            open_bal_tl = prep_our.loc[mask_open_our, "Signed_TL"].sum()
+            open_bal_fx = prep_our.loc[mask_open_our, "Signed_FX"].sum()
+            prep_our = prep_our[~mask_open_our].copy()
+            
+            new_row = pd.DataFrame([{
+                "Doc_Category": "ACILIS", 
+                "Signed_TL": open_bal_tl,
+                "Signed_FX": open_bal_fx,
+                "std_date": t_open,
+                "PB_Norm": "TL", 
+                "Kaynak_Dosya": "DEVİR_BAKİYESİ",
+                map_our["inv_no"]: "__ACILIS__"
+            }])
+            prep_our = pd.concat([new_row, prep_our], ignore_index=True)
+    
+    if "ACILIS" in prep_their["Doc_Category"].unique():
+         prep_their.loc[prep_their["Doc_Category"]=="ACILIS", map_their["inv_no"]] = "__ACILIS__"
+    
+    prep_our["key_invoice_norm"] = prep_our[map_our["inv_no"]].apply(get_invoice_key)
+    prep_our.loc[prep_our[map_our["inv_no"]] == "__ACILIS__", "key_invoice_norm"] = "__ACILIS__"
+
+    prep_their["key_invoice_norm"] = prep_their[map_their["inv_no"]].apply(get_invoice_key)
+    prep_their.loc[prep_their[map_their["inv_no"]] == "__ACILIS__", "key_invoice_norm"] = "__ACILIS__"
+
+    ignored_our = prep_our[prep_our["Doc_Category"] == "DIGER"]
+    ignored_their = prep_their[prep_their["Doc_Category"] == "DIGER"]
+
+    # --- EŞLEŞTİRME ---
+    inv_our = prep_our[prep_our["Doc_Category"].isin(["FATURA", "ACILIS"])]
+    inv_their = prep_their[prep_their["Doc_Category"].isin(["FATURA", "ACILIS"])]
+    
+    def build_agg(mapping):
+        agg = {"Signed_TL": "sum", "Signed_FX": "sum", "std_date": "max", "PB_Norm": "first", "Kaynak_Dosya": "first", "Satır_No": "first"}
+        if mapping.get("inv_no"): agg[mapping["inv_no"]] = "first"
+        if mapping.get("pay_no"): agg[mapping["pay_no"]] = "first"
+        if mapping.get("curr"): agg[mapping["curr"]] = "first" 
+        for ec in mapping.get("extra_cols", []): agg[ec] = "first"
+        return agg
+
+    gk_our = ["key_invoice_norm"] + ([map_our["curr"]] if map_our["curr"] else [])
+    gk_their = ["key_invoice_norm"] + ([map_their["curr"]] if map_their["curr"] else [])
+    
+    grp_our = inv_our.groupby(gk_our, as_index=False).agg(build_agg(map_our))
+    grp_their = inv_their.groupby(gk_their, as_index=False).agg(build_agg(map_their))
+    
+    grp_our = force_suffix(grp_our, "_Biz", "key_invoice_norm")
+    grp_their = force_suffix(grp_their, "_Onlar", "key_invoice_norm")
+    
+    merged_inv = pd.merge(grp_our, grp_their, on="key_invoice_norm", how="outer")
+    merged_inv["Eşleşme_Kuralı"] = np.where(merged_inv["Signed_TL_Biz"].notna() & merged_inv["Signed_TL_Onlar"].notna(), "Fatura No", None)
+    
+    merged_inv["Fark_TL"] = smart_diff(merged_inv, "Signed_TL_Biz", "Signed_TL_Onlar")
+    merged_inv["Fark_FX"] = smart_diff(merged_inv, "Signed_FX_Biz", "Signed_FX_Onlar")
+    progress("Fatura Eşleştirme", len(merged_inv))
+
+    # --- ÖDEME ---
+    pay_our = prep_our[prep_our["Doc_Category"].str.contains("ODEME")].copy()
+    pay_their = prep_their[prep_their["Doc_Category"].str.contains("ODEME")].copy()
+    
+    pay_our = pay_our.sort_values(by=["std_date", "Signed_TL"])
+    pay_their = pay_their.sort_values(by=["std_date", "Signed_TL"])
+
+    pairs, rem_our, rem_their = run_match_passes(pay_our, pay_their, map_our, map_their, match_passes)
+    pay_our = force_suffix(pay_our, "_Biz", [])
+    pay_their = force_suffix(pay_their, "_Onlar", [])
+
+    # Eşleşen çiftler yan yana, kalanlar tek taraflı (outer merge ile aynı yapı)
+    matched_pay = pd.concat([
+        pay_our.loc[pairs["idx_l"]].reset_index(drop=True),
+        pay_their.loc[pairs["idx_r"]].reset_index(drop=True),
+        pairs[["Eşleşme_Kuralı"]].reset_index(drop=True),
+    ], axis=1)
+    merged_pay = pd.concat([matched_pay, pay_our.loc[rem_our], pay_their.loc[rem_their]], ignore_index=True)
+    merged_pay["Fark_TL"] = smart_diff(merged_pay, "Signed_TL_Biz", "Signed_TL_Onlar")
+    merged_pay["Fark_FX"] = smart_diff(merged_pay, "Signed_FX_Biz", "Signed_FX_Onlar")
+    progress("Ödeme Eşleştirme", len(merged_pay))
+
+    # --- BAKİYE ---
+    our_bal = prep_our.groupby("PB_Norm")[["Signed_TL", "Signed_FX"]].sum().reset_index()
+    their_bal = prep_their.groupby("PB_Norm")[["Signed_TL", "Signed_FX"]].sum().reset_index()
+    balance_summary = pd.merge(our_bal, their_bal, on="PB_Norm", how="outer", suffixes=("_Biz", "_Onlar")).fillna(0)
+    balance_summary["Net_Fark_TL"] = smart_diff(balance_summary, "Signed_TL_Biz", "Signed_TL_Onlar")
+    balance_summary["Net_Fark_FX"] = smart_diff(balance_summary, "Signed_FX_Biz", "Signed_FX_Onlar")
+    aging_base = build_aging_base(merged_inv)
+    progress("Bakiye & Yaşlandırma", len(aging_base["df"]))
+
+    return {
+        "inv_match": format_clean_view(merged_inv[merged_inv["Signed_TL_Biz"].notna() & merged_inv["Signed_TL_Onlar"].notna()], map_our, map_their, "FATURA"),
+        "inv_bizde": format_clean_view(merged_inv[merged_inv["Signed_TL_Biz"].notna() & merged_inv["Signed_TL_Onlar"].isna()], map_our, map_their, "FATURA"),
+        "inv_onlar": format_clean_view(merged_inv[merged_inv["Signed_TL_Biz"].isna() & merged_inv["Signed_TL_Onlar"].notna()], map_our, map_their, "FATURA"),
+        "pay_match": format_clean_view(merged_pay, map_our, map_their, "ODEME"),
+        "ignored_our": ignored_our, "ignored_their": ignored_their, "balance_summary": balance_summary,
+        "prep_our": prep_our, "prep_their": prep_their, "merged_inv": merged_inv, "merged_pay": merged_pay,
+        "aging_base": aging_base, "aging_cache": {},
+        "map_our": map_our, "map_their": map_their
+    }
+
+# ==========================================
+# 6. ARKA PLAN İŞLERİ (JOB)
+# ==========================================
+ANALYSIS_STAGES = ["Hazırlık (Biz)", "Hazırlık (Onlar)", "Fatura Eşleştirme", "Ödeme Eşleştirme", "Bakiye & Yaşlandırma"]
+
+class JobCancelled(Exception):
+    pass
+
+class AnalysisJob:
+    """Arka planda çalışan analiz. Aşama ilerlemesini tutar, aşama aralarında iptal kontrolü yapar."""
+    def __init__(self):
+        self.stages = []  # [(aşama, işlenen satır)]
+        self.cancel_event = threading.Event()
+        self.future = None
+        self.started = time.time()
+
+    def check(self):
+        if self.cancel_event.is_set(): raise JobCancelled()
+
+    def report(self, stage, rows):
+        self.stages.append((stage, rows))
+        self.check()
+
+    def cancel(self):
+        self.cancel_event.set()
+        # Kuyrukta bekliyorsa hiç başlamasın
+        if self.future is not None: self.future.cancel()
+
+    def result(self):
+        try: return self.future.result()
+        except CancelledError: raise JobCancelled()
+
+    @property
+    def done(self):
+        return self.future is not None and self.future.done()
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+def get_worker_pool():
+    # Modül bir kez yüklendiği için havuz tüm oturumlar ve rerun'lar boyunca tektir
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None: _POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="recomatch")
+    return _POOL
+
+# ==========================================
+# 7. DOSYA OKUMA & EXCEL ÇIKTI
+# ==========================================
+def read_files(files):
+    """files: [(dosya_adı, bytes)]. Dönen: (birleşik df, [hata mesajları]). xlsx motoru sadece xlsx gelince yüklenir."""
+    from io import BytesIO
+    if not files: return pd.DataFrame(), []
+    df_list, errors = [], []
+    for name, data in files:
+        try:
+            f = BytesIO(data)
+            if name.lower().endswith(".csv"):
+                try: temp_df = pd.read_csv(f, dtype=str, sep=None, engine='python')
+                except: f.seek(0); temp_df = pd.read_csv(f, dtype=str, sep=';')
+            else:
+                temp_df = pd.read_excel(f, header=0, dtype=str)
+            
+            if temp_df.empty: continue
+            temp_df.columns = temp_df.columns.astype(str).str.strip()
+            temp_df["Satır_No"] = temp_df.index + 2 
+            temp_df["Orj_Row_Idx"] = temp_df.index
+            
+            for col in temp_df.columns:
+                if col not in ["Satır_No", "Orj_Row_Idx"]:
+                    temp_df[col] = temp_df[col].astype(str).str.strip().replace({'nan': '', 'None': ''})
+            temp_df["Kaynak_Dosya"] = name
+            df_list.append(temp_df)
+        except Exception as e:
+            errors.append(f"Dosya hatası ({name}): {e}")
+    if not df_list: return pd.DataFrame(), errors
+    return pd.concat(df_list, ignore_index=True), errors
+
+def build_excel_report(summary_df, res, aging_df):
+    """Rapor xlsx'ini üretir. xlsxwriter sadece burada (indirme istenince) yüklenir."""
+    from io import BytesIO
+    output = BytesIO()
+    writer = pd.ExcelWriter(output, engine='xlsxwriter')
+    summary_df.to_excel(writer, sheet_name='Ozet', index=False)
+    res["inv_match"].to_excel(writer, sheet_name='Fatura_Eslesme', index=False)
+    res["inv_bizde"].to_excel(writer, sheet_name='Bizde_Var_Onlarda_Yok', index=False)
+    res["inv_onlar"].to_excel(writer, sheet_name='Onlarda_Var_Bizde_Yok', index=False)
+    res["pay_match"].to_excel(writer, sheet_name='Odeme_Eslesme', index=False)
+    if not aging_df.empty: aging_df.to_excel(writer, sheet_name='Yaslandirma', index=False)
+    writer.close()
+    return output.getvalue()
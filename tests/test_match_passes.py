@@ -0,0 +1,21 @@
+import pandas as pd
+
+import reco_engine as eng
+
+CFG = {"pay_no": "Ref"}
+
+def make_pay(refs, amounts, dates):
+    return pd.DataFrame({
+        "Ref": refs,
+        "Signed_TL": amounts,
+        "std_date": pd.to_datetime(dates),
+        "Doc_Category": "ODEME",
+    })
+
+def test_ref_in_desc_pairs_one_to_one():
+    # Aynı tutarda, birbirini içeren referanslar: her iki satır da eşleşmeli
+    left = make_pay(["REF1234", "XREF1234"], [50000, 50000], ["2025-02-20", "2025-02-21"])
+    right = make_pay(["REF1234", "XREF1234"], [-50000, -50000], ["2025-02-20", "2025-02-21"])
+    pairs, rem_l, rem_r = eng.run_match_passes(left, right, CFG, CFG, ["ref_in_desc"])
+    assert sorted(zip(pairs["idx_l"], pairs["idx_r"])) == [(0, 0), (1, 1)]
+    assert rem_l.empty and rem_r.empty